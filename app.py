@@ -1,6 +1,7 @@
 # app.py (Streamlit UI)
 import streamlit as st
 import pandas as pd
+import numpy as np
 import logging
 import time
 
@@ -9,13 +10,25 @@ from modules.data_fetcher import ETFDataFetcher
 from modules.storage import CSVStorage
 from modules.reporter import ReportGenerator
 from modules.data_processor import ETFComparator
+from modules.kernels import perf_kernel
 from modules.plotter import ETFVisualizer
 from main import init_historical_data, update_daily_data, schedule_tasks
 
 # 如果需要日誌顯示在 Streamlit console:
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s - %(message)s")
 
+@st.cache_resource
+def get_services():
+    """建立並快取 config 與服務物件，避免每次 rerun 重新解析 YAML、重建物件"""
+    config = load_config()
+    storage = CSVStorage(config.get('data_dir', 'data'), use_parquet=config.get('fast_io', False))
+    fetcher = ETFDataFetcher(config)
+    reporter = ReportGenerator(storage)
+    comparator = ETFComparator(storage, fast_df=config.get('fast_df'))
+    return config, storage, fetcher, reporter, comparator
+
 # 輔助函式：用於依期間過濾資料 (2w/1m/3m/1y/3y)
+@st.cache_data
 def filter_by_period(df, period='1m'):
     # 簡易示範
     period_map = {
@@ -32,30 +45,26 @@ def filter_by_period(df, period='1m'):
         return df
     end_date = df['Date'].max()
     start_date = end_date - pd.Timedelta(days=days)
+    if df['Date'].is_monotonic_increasing:
+        # 已排序時用二分搜尋切片，免去建立整欄布林遮罩
+        dates = df['Date'].to_numpy()
+        lo = np.searchsorted(dates, start_date.to_datetime64())
+        hi = np.searchsorted(dates, end_date.to_datetime64(), side='right')
+        return df.iloc[lo:hi]
     return df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
 
-def color_performance(val):
-    try:
-        numeric_val = float(val)
-    except ValueError:
-        return ''  # 非數值或空白就不改顏色
-
-    if numeric_val > 0:
-        return 'color: red'
-    elif numeric_val < 0:
-        return 'color: green'
-    else:
-        return ''
-    
+def color_performance(block):
+    """整批上色 (正值紅、負值綠)：對整個子表一次算出CSS，取代逐格呼叫"""
+    arr = block.to_numpy()
+    out = np.where(arr > 0, 'color: red', np.where(arr < 0, 'color: green', ''))
+    return pd.DataFrame(out, index=block.index, columns=block.columns)
+
+
 def main():
     st.title("Taiwan ETF Tracker Dashboard")
 
-    # 載入config，初始化物件
-    config = load_config()
-    storage = CSVStorage(config.get('data_dir', 'data'))
-    fetcher = ETFDataFetcher(config)
-    reporter = ReportGenerator(storage)
-    comparator = ETFComparator(storage)
+    # 載入config，初始化物件 (快取於 st.cache_resource，跨 rerun 重用)
+    config, storage, fetcher, reporter, comparator = get_services()
 
     # 區塊1: 功能按鈕 (初始化、更新、排程)
     # st.subheader("系統操作")
@@ -101,16 +110,14 @@ def main():
 
     # 根據 session_state 決定是否顯示
     if st.session_state["show_etf_dates"]:
+        # 只讀各檔案的中繼資料/尾端取最後日期，不需載入整份歷史
         etf_data = []
         for etf in config['etf_list']:
             etf_code = etf['code']
-            df = storage.load_data(etf_code)
-            if df.empty:
-                etf_data.append({"ETF 代號": etf_code, "最後資料更新日期": "尚未有資料"})
-            else:
-                last_date = df['Date'].max().strftime('%Y-%m-%d')
-                etf_data.append({"ETF 代號": etf_code, "最後資料更新日期": last_date})
-        
+            last_date = storage.last_date(etf_code)
+            etf_data.append({"ETF 代號": etf_code,
+                             "最後資料更新日期": last_date or "尚未有資料"})
+
         etf_df = pd.DataFrame(etf_data)
         st.dataframe(etf_df)
         st.info("以上是目前系統中各ETF的最後更新日期。")
@@ -179,63 +186,63 @@ def main():
             st.error("請先在上方選擇要比較的ETF!")
         else:
             selected_full_etfs = [(etf.get("code"), etf.get("name")) for etf in config['etf_list'] if etf.get("code") in selected_etfs]
-            # 用來儲存成果
-            performance_data = []
-            
-            for code, name in selected_full_etfs:
-                # 讀取CSV / DataFrame
+
+            # 一次合併所有ETF資料，用單一 groupby 向量化計算，避免逐檔 Python 迴圈
+            start_ts = pd.to_datetime(user_start_date)
+            end_ts = pd.to_datetime(user_end_date)
+            frames = []
+            # storage.load_data 以檔案 mtime 為鍵快取，重複載入便宜且
+            # 在 init/update 寫檔後自動失效，不需要另一層 st.cache_data
+            for code, _ in selected_full_etfs:
                 df_etf = storage.load_data(code)
                 if df_etf.empty:
-                    # 若沒有資料就略過或標註
-                    import math
+                    continue
+                # 各檔資料已依Date排序，以二分搜尋取區間切片，免建整欄布林遮罩
+                dates = df_etf['Date'].to_numpy()
+                lo = np.searchsorted(dates, start_ts.to_datetime64())
+                hi = np.searchsorted(dates, end_ts.to_datetime64(), side='right')
+                if lo < hi:
+                    frames.append(df_etf.iloc[lo:hi].assign(code=code))
+
+            if frames:
+                # 各切片已排序且同一code相鄰，concat後可直接 groupby；
+                # code 轉 Categorical 讓 groupby 走整數編碼而非逐一比對字串
+                big = pd.concat(frames, ignore_index=True)
+                big['code'] = pd.Categorical(big['code'],
+                                             categories=[c for c, _ in selected_full_etfs])
+                agg = big.groupby('code', sort=False, observed=True).agg(
+                    start=('Close', 'first'), end=('Close', 'last'),
+                    d0=('Date', 'first'), d1=('Date', 'last'))
+
+                # 累積漲幅與年化報酬率 (單純以天數計算)，整批交給 JIT kernel
+                days = (agg['d1'] - agg['d0']).dt.days.to_numpy()
+                cum, annual = perf_kernel(agg['start'].to_numpy(dtype=np.float64),
+                                          agg['end'].to_numpy(dtype=np.float64),
+                                          days.astype(np.float64))
+                # 直接儲存浮點數 => 例如 10.5 代表 +10.5%
+                agg['cum'] = cum * 100
+                agg['annual'] = annual * 100
+            else:
+                agg = pd.DataFrame(columns=['cum', 'annual'])
+
+            # 用來儲存成果 (區間內無資料的ETF標註 NaN)
+            performance_data = []
+            for code, name in selected_full_etfs:
+                if code in agg.index:
                     performance_data.append({
                         "ETF代號": code,
                         "ETF名稱": name,
-                        "累積漲幅(%)": math.nan,
-                        "年化報酬率(%)": math.nan
+                        "累積漲幅(%)": agg.at[code, 'cum'],
+                        "年化報酬率(%)": agg.at[code, 'annual']
                     })
-                    continue
-
-                # 過濾指定區間
-                mask = (df_etf['Date'] >= pd.to_datetime(user_start_date)) & \
-                       (df_etf['Date'] <= pd.to_datetime(user_end_date))
-                df_period = df_etf[mask].sort_values('Date')
-
-                if df_period.empty:
-                    # 該ETF在此區間無資料
-                    import math
+                else:
                     performance_data.append({
                         "ETF代號": code,
                         "ETF名稱": name,
-                        "累積漲幅(%)": math.nan,
-                        "年化報酬率(%)": math.nan
+                        "累積漲幅(%)": np.nan,
+                        "年化報酬率(%)": np.nan
                     })
-                    continue
-                
-                # 取得第一筆收盤價, 最後一筆收盤價
-                start_close = df_period.iloc[0]['Close']
-                end_close   = df_period.iloc[-1]['Close']
-
-                # 累積漲幅
-                cum_return = (end_close - start_close) / start_close  # e.g. 0.05 => 5%
-                
-                # 計算天數
-                num_days = (df_period.iloc[-1]['Date'] - df_period.iloc[0]['Date']).days
-                if num_days <= 0:
-                    # 交易日太少或同一天
-                    annual_return = 0
-                else:
-                    # 年化報酬率 (單純以天數計算)
-                    annual_return = (1 + cum_return)**(365/num_days) - 1
-
-                performance_data.append({
-                    "ETF代號": code,
-                    "ETF名稱": name,
-                    # 直接儲存浮點數 => 例如 10.5 代表 +10.5%
-                    "累積漲幅(%)": cum_return * 100,  
-                    "年化報酬率(%)": annual_return * 100
-                })
-            
+
             # 產出表格
             perf_df = pd.DataFrame(performance_data)
 
@@ -243,7 +250,7 @@ def main():
                 subset=["累積漲幅(%)", "年化報酬率(%)"],
                 formatter="{:.2f}%"
             )
-            perf_df_styled = perf_df_styled.applymap(color_performance,
+            perf_df_styled = perf_df_styled.apply(color_performance, axis=None,
                 subset=["累積漲幅(%)", "年化報酬率(%)"]
             )
             st.dataframe(perf_df_styled)
@@ -15,6 +15,8 @@ def load_config():
             etf_list = yaml.safe_load(f)
         
         config['etf_list'] = etf_list
+        # 預設關閉 fast_io (Parquet)，可在 settings.yaml 開啟
+        config.setdefault('fast_io', False)
         return config
     
     except FileNotFoundError as e:
@@ -13,23 +13,39 @@ from modules.data_fetcher import ETFDataFetcher
 from modules.storage import CSVStorage
 from modules.reporter import ReportGenerator
 
+# 以設定值為鍵快取服務物件；Streamlit 每次按鈕點擊都會重新進入
+# init_historical_data / update_daily_data，不需要每次重建物件
+_services_cache = {}
+
+def _services(config):
+    """取得共用的 (fetcher, storage, reporter)，同一組設定只建構一次"""
+    key = (config.get('data_dir', 'data'),
+           config.get('fast_io', False),
+           config.get('data_source', {}).get('primary', 'twse'),
+           config.get('twse_concurrency', 4))
+    if key not in _services_cache:
+        storage = CSVStorage(config.get('data_dir', 'data'), use_parquet=config.get('fast_io', False))
+        fetcher = ETFDataFetcher(config)
+        reporter = ReportGenerator(storage)
+        _services_cache[key] = (fetcher, storage, reporter)
+    return _services_cache[key]
+
 def init_historical_data(config):
     """使用多執行緒加速抓取多檔ETF的歷史數據，並確保所有任務執行完畢後才返回"""
-    fetcher = ETFDataFetcher(config)
-    storage = CSVStorage(config.get('data_dir', 'data'))
-    reporter = ReportGenerator(storage)
+    fetcher, storage, reporter = _services(config)
 
     etf_list = config['etf_list']
-    total_months = 0  # 計算總月份數
+
+    # 一次向量化算出各ETF的月份數與總月份數 (進度條分母)，不必逐檔迴圈
+    starts = pd.to_datetime([etf['start_date'] for etf in etf_list])
+    now = pd.Timestamp.now()
+    months_per_etf = (now.year - starts.year) * 12 + (now.month - starts.month) + 1
+    total_months = int(months_per_etf.sum())
+
     completed_months = [0]  # 使用 list，確保多執行緒能修改此變數
-    
-    # 計算所有 ETF 需要抓取的「總月份數」
-    for etf in etf_list:
-        start_date = pd.to_datetime(etf['start_date'])
-        end_date = pd.Timestamp.now()
-        total_months += (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month) + 1
-
-    def fetch_and_save(etf):
+    progress_lock = threading.Lock()  # 保護計數器與進度條更新
+
+    def fetch_and_save(etf, months_count):
         """子任務：抓取並儲存 ETF 數據"""
         etf_code = etf['code']
         start_date = etf['start_date']
@@ -42,16 +58,11 @@ def init_historical_data(config):
             logging.info(f"[{threading.current_thread().name}] {report}")
         else:
             logging.warning(f"[{threading.current_thread().name}] {etf_code} 歷史資料抓取失敗")
-    
-         # 計算該 ETF 的月份數
-        start_dt = pd.to_datetime(start_date)
-        end_dt = pd.Timestamp.now()
-        months_count = (end_dt.year - start_dt.year) * 12 + (end_dt.month - start_dt.month) + 1
-
-        # 更新進度條
-        for _ in range(months_count):
-            completed_months[0] += 1
-            progress_bar.progress(completed_months[0] / total_months)
+
+        # 每檔ETF完成後只更新一次進度，避免 O(總月份數) 次 widget 重繪
+        with progress_lock:
+            completed_months[0] += months_count
+            progress_bar.progress(min(1.0, completed_months[0] / total_months))
             progress_text.text(f"進度: {completed_months[0]} / {total_months} 個月份已抓取")
 
     # 初始化 Streamlit 進度條
@@ -61,7 +72,8 @@ def init_historical_data(config):
     # 使用 ThreadPoolExecutor 並行抓取
     max_workers = min(10, len(etf_list))  # 限制最多 10 個執行緒
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(fetch_and_save, etf) for etf in etf_list]
+        futures = [executor.submit(fetch_and_save, etf, int(months))
+                   for etf, months in zip(etf_list, months_per_etf)]
         concurrent.futures.wait(futures)  # 確保所有任務執行完畢
 
     # 設定進度條為 100%（確保不會卡在 99%）
@@ -69,15 +81,24 @@ def init_historical_data(config):
     progress_text.text("✅ 所有 ETF 歷史數據抓取完成！")
 
 def update_daily_data(config):
-    """每日更新資料"""
-    fetcher = ETFDataFetcher(config)
-    storage = CSVStorage(config.get('data_dir', 'data'))
+    """每日更新資料：從既有檔案的最後日期起做增量抓取"""
+    fetcher, storage, _ = _services(config)
 
-    today_str = pd.Timestamp.now().strftime('%Y-%m-%d')
     for etf in config['etf_list']:
         etf_code = etf['code']
-        print(f"[更新] 抓取 {etf_code} {today_str} 當日資料...")
-        df = fetcher.fetch_daily_data(etf_code, start_date=today_str)
+        # 只抓缺少的日期區間，而非整段歷史
+        existing = storage.load_data(etf_code)
+        if existing.empty:
+            start_date = etf['start_date']
+        else:
+            next_date = existing['Date'].max() + pd.Timedelta(days=1)
+            if next_date > pd.Timestamp.now():
+                logging.info(f"{etf_code} 資料已是最新，略過")
+                continue
+            start_date = next_date.strftime('%Y-%m-%d')
+
+        print(f"[更新] 抓取 {etf_code} 自 {start_date} 起的增量資料...")
+        df = fetcher.fetch_daily_data(etf_code, start_date=start_date)
         if not df.empty:
             storage.save_data(etf_code, df)
         else:
@@ -106,10 +127,15 @@ def main():
     parser.add_argument("--init", action="store_true", help="初始化歷史資料")
     parser.add_argument("--update", action="store_true", help="更新當日資料")
     parser.add_argument("--schedule", action="store_true", help="啟動每日排程")
+    parser.add_argument("--migrate", action="store_true", help="將既有CSV資料轉成Parquet")
 
     args = parser.parse_args()
 
     # 根據參數執行
+    if args.migrate:
+        _, storage, _ = _services(config)
+        count = storage.migrate_csv_to_parquet()
+        print(f"已轉換 {count} 個CSV檔為Parquet")
     if args.init:
         init_historical_data(config)
     if args.update:
@@ -1,13 +1,31 @@
 # modules/data_fetcher.py
+import asyncio
+import io
 import logging
 import requests
 import pandas as pd
-import time
+import numpy as np
+import threading
+import concurrent.futures
 from datetime import datetime
-from functools import lru_cache
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+try:
+    import httpx
+    _HAS_HTTPX = True
+except ImportError:
+    _HAS_HTTPX = False
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
 class DataFetchError(Exception):
     pass
 
@@ -16,8 +34,30 @@ class ETFDataFetcher:
         # 預設資料來源改為 'twse'（可在 settings.yaml 設定）
         # 若想保留 Yahoo Finance 作為fallback，也可在此判斷 data_source
         self.data_source = config.get('data_source', {}).get('primary', 'twse')
+        # 逐月抓取的並行度；同時也是對 TWSE 同時連線數的禮貌上限
+        self.twse_concurrency = config.get('twse_concurrency', 4)
+        self._rate = threading.Semaphore(self.twse_concurrency)
+        # twse_http2: 以 httpx 的 HTTP/2 多工改抓 JSON 端點 (需安裝 httpx[http2])
+        self.use_http2 = config.get('twse_http2', False) and _HAS_HTTPX
+        if config.get('twse_http2', False) and not _HAS_HTTPX:
+            logger.warning("未安裝 httpx，twse_http2 設定無效，改用執行緒池抓取")
+        # 已收盤月份的原始資料不會再變動，落地成 Parquet 快取避免重複下載
+        self._raw_cache_dir = Path(config.get('data_dir', 'data')) / 'raw_twse'
+        self.cache_raw_months = config.get('cache_raw_months', True) and _HAS_PYARROW
+        if self.cache_raw_months:
+            self._raw_cache_dir.mkdir(parents=True, exist_ok=True)
+        # 共用 Session 以重用 TCP/TLS 連線 (HTTP keep-alive)；
+        # 重試交給 urllib3 的 Retry (指數退避)，不再於程式內手動重試
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8, pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self._session.mount("https://", adapter)
+        # TWSE 的 CSV 壓縮率很高，要求 gzip 可大幅減少傳輸量
+        self._session.headers.update({"Accept-Encoding": "gzip"})
 
-    @lru_cache(maxsize=32)
     def fetch_daily_data(self, etf_code, start_date):
         """
         從TWSE官網抓取指定ETF自 start_date (YYYY-MM-DD) 之後的所有日線資料。
@@ -46,103 +86,204 @@ class ETFDataFetcher:
         start_dt = pd.to_datetime(start_date)
         end_dt = pd.Timestamp.now()  # 抓到今天
         
-        # 2. 建立 month list，例如從 2012-01 到 2025-01
-        all_months = []
-        current = pd.Timestamp(start_dt.year, start_dt.month, 1)
-        while current <= end_dt:
-            all_months.append(current)
-            # 下個月
-            next_month = current.month + 1 if current.month < 12 else 1
-            next_year = current.year + 1 if current.month == 12 else current.year
-            current = pd.Timestamp(next_year, next_month, 1)
+        # 2. 建立 month list，例如從 2012-01 到 2025-01 (freq='MS' = 每月1日)；
+        # 月份鍵一次向量化產生，工作函式不必逐次呼叫 strftime
+        all_months = pd.date_range(pd.Timestamp(start_dt.year, start_dt.month, 1),
+                                   end_dt, freq='MS')
+        month_keys = all_months.strftime('%Y%m01')  # e.g. '20120101'
 
-        all_df = []
-        for month_start in all_months:
-            yyyymmdd = month_start.strftime("%Y%m01")  # e.g. '20120101'
-            logger.info(f"抓取 {etf_code} {month_start.strftime('%Y-%m')} 月份資料...")
+        def fetch_one(yyyymmdd):
+            logger.info(f"抓取 {etf_code} {yyyymmdd[:4]}-{yyyymmdd[4:6]} 月份資料...")
             try:
-                df_month = self._fetch_twse_one_month(etf_code, yyyymmdd)
-                all_df.append(df_month)
-                time.sleep(0.5)  # 禮貌性延遲，避免對官方站點造成壓力
+                return self._fetch_twse_one_month(etf_code, yyyymmdd)
             except Exception as e:
-                logger.warning(f"{etf_code} {month_start} 資料抓取失敗: {e}")
+                logger.warning(f"{etf_code} {yyyymmdd} 資料抓取失敗: {e}")
+                return pd.DataFrame(columns=['Date','Close','Volume'])
+
+        if self.use_http2:
+            # 單一 HTTP/2 連線多工所有月份請求，抓 JSON 端點免去 big5 CSV 解碼
+            all_df = asyncio.run(self._fetch_months_async(etf_code, month_keys))
+        else:
+            # 逐月抓取為純網路等待 (GIL在requests.get期間釋放)，以執行緒池並行；
+            # semaphore 限制同時在途的請求數，取代原本的 time.sleep 禮貌延遲
+            max_workers = min(self.twse_concurrency, len(month_keys)) or 1
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                all_df = [df for df in executor.map(fetch_one, month_keys) if not df.empty]
 
         if not all_df:
             raise DataFetchError(f"{etf_code} 自 {start_date} 起無可用資料")
 
-        final_df = pd.concat(all_df, ignore_index=True)
-        # 篩掉 start_date 之前的資料
-        final_df = final_df[final_df['Date'] >= start_dt]
-        final_df = final_df.sort_values('Date').drop_duplicates('Date')
-        return final_df
+        # 各月份彼此不重疊、且依月份順序排列 (map/gather 保持輸入順序)，
+        # 直接串接各欄位陣列一次建表即可；篩掉 start_date 之前的資料
+        # 改用二分搜尋切片，不需要全量 sort_values / drop_duplicates
+        dates = np.concatenate([df['Date'].to_numpy() for df in all_df])
+        closes = np.concatenate([df['Close'].to_numpy() for df in all_df])
+        volumes = np.concatenate([df['Volume'].to_numpy() for df in all_df])
+        lo = np.searchsorted(dates, start_dt.to_datetime64())
+        return pd.DataFrame({'Date': dates[lo:], 'Close': closes[lo:], 'Volume': volumes[lo:]})
+
+    def _raw_cache_path(self, etf_code, yyyymmdd):
+        """
+        已收盤月份的快取路徑；當月資料仍會變動，不做快取 (回傳 None)
+        """
+        if not self.cache_raw_months:
+            return None
+        yyyymm = yyyymmdd[:6]
+        if yyyymm == pd.Timestamp.now().strftime('%Y%m'):
+            return None
+        return self._raw_cache_dir / f"{etf_code}_{yyyymm}.parquet"
+
+    def _load_cached_month(self, cache_path):
+        """讀取月份快取，失敗或不存在時回傳 None (改走網路)"""
+        if cache_path is not None and cache_path.exists():
+            try:
+                return pd.read_parquet(cache_path, engine='pyarrow')
+            except Exception as e:
+                logger.warning(f"讀取月份快取 {cache_path.name} 失敗: {e}")
+        return None
+
+    def _store_cached_month(self, cache_path, df):
+        """將已收盤月份的解析結果寫入快取；失敗只記錄，不影響主流程"""
+        if cache_path is not None and not df.empty:
+            try:
+                df.to_parquet(cache_path, engine='pyarrow', compression='zstd', index=False)
+            except Exception as e:
+                logger.warning(f"寫入月份快取 {cache_path.name} 失敗: {e}")
+
+    async def _fetch_months_async(self, etf_code, month_keys):
+        """
+        以 httpx.AsyncClient(http2=True) 在單一連線上並行抓取各月份，
+        改用 STOCK_DAY 的 JSON 回應 (payload 較小、無需 big5 解碼)
+        :param month_keys: 'YYYYMM01' 格式的月份鍵序列
+        :return: list of DataFrame(columns=['Date','Close','Volume'])，已濾掉空月份
+        """
+        url_tmpl = ("https://www.twse.com.tw/exchangeReport/STOCK_DAY"
+                    f"?response=json&stockNo={etf_code}&date={{}}")
+        limits = httpx.Limits(max_connections=self.twse_concurrency)
+
+        # Semaphore 限制同時在途請求數，加上短暫延遲維持對官方站點的禮貌節流
+        sem = asyncio.Semaphore(self.twse_concurrency)
+
+        async with httpx.AsyncClient(http2=True, timeout=10, limits=limits) as client:
+            async def fetch_one(yyyymmdd):
+                cache_path = self._raw_cache_path(etf_code, yyyymmdd)
+                cached = self._load_cached_month(cache_path)
+                if cached is not None:
+                    return cached
+                async with sem:
+                    logger.info(f"抓取 {etf_code} {yyyymmdd[:4]}-{yyyymmdd[4:6]} 月份資料...")
+                    await asyncio.sleep(0.25)
+                    resp = await client.get(url_tmpl.format(yyyymmdd))
+                    df_month = self._parse_twse_json(etf_code, yyyymmdd, resp)
+                    self._store_cached_month(cache_path, df_month)
+                    return df_month
 
-    def _fetch_twse_one_month(self, etf_code, yyyymmdd, max_retries=3, retry_delay=2):
+            # return_exceptions=True：單一月份失敗不中斷其他月份的抓取
+            results = await asyncio.gather(*(fetch_one(m) for m in month_keys),
+                                           return_exceptions=True)
+
+        all_df = []
+        for yyyymmdd, result in zip(month_keys, results):
+            if isinstance(result, Exception):
+                logger.warning(f"{etf_code} {yyyymmdd[:6]} 資料抓取失敗: {result}")
+            elif not result.empty:
+                all_df.append(result)
+        return all_df
+
+    def _parse_twse_json(self, etf_code, yyyymmdd, resp):
+        """解析 STOCK_DAY JSON 回應 (欄位順序與 CSV 版相同)"""
+        if resp.status_code != 200:
+            raise DataFetchError(f"HTTP 狀態碼非 200: {resp.status_code}")
+
+        payload = resp.json()
+        data = payload.get('data')
+        if not data:
+            logging.warning(f"[{etf_code} {yyyymmdd}] 該月份無資料，直接返回空 DataFrame")
+            return pd.DataFrame(columns=['Date','Close','Volume'])
+
+        df = pd.DataFrame(data, columns=payload['fields'])
+        df = df[df['日期'].astype(str).str.match(r'\d+/\d+/\d+')]
+        if df.empty:
+            return pd.DataFrame(columns=['Date','Close','Volume'])
+
+        # 與 CSV 路徑相同的向量化民國年轉換
+        parts = df['日期'].str.split('/', expand=True).astype(np.int32)
+        ymd = (parts[0] + 1911) * 10000 + parts[1] * 100 + parts[2]
+
+        return pd.DataFrame({
+            'Date': pd.to_datetime(ymd, format='%Y%m%d'),
+            'Close': pd.to_numeric(df['收盤價'].str.replace(',', ''), errors='coerce'),
+            'Volume': pd.to_numeric(df['成交股數'].str.replace(',', ''), errors='coerce'),
+        })
+
+    def _fetch_twse_one_month(self, etf_code, yyyymmdd):
         """
         抓取「特定年月」的成交資訊，並解析成DataFrame
+        (暫時性失敗由 Session 上掛載的 urllib3 Retry 自動重試)
         :param etf_code: '0050'
         :param yyyymmdd: '20250101' (只會回傳該月資料)
-        :param max_retries: 最大重試次數 (預設 3 次)
-        :param retry_delay: 每次重試前等待秒數 (預設 2 秒)
         :return: DataFrame(columns=['Date','Close','Volume'])
         """
         url = f"https://www.twse.com.tw/exchangeReport/STOCK_DAY?response=csv&date={yyyymmdd}&stockNo={etf_code}"
-        
-        for attempt in range(1, max_retries + 1):  # 重試最多 max_retries 次
-            try:
-                resp = requests.get(url, timeout=10)  # 設定 timeout 避免請求卡住
-                resp.encoding = 'big5'  # TWSE CSV 通常是 big5
-
-                if resp.status_code != 200:
-                    raise DataFetchError(f"HTTP 狀態碼非 200: {resp.status_code}")
 
-                lines = resp.text.split('\n')
+        # 已收盤月份若有本地快取，完全免去網路往返
+        cache_path = self._raw_cache_path(etf_code, yyyymmdd)
+        cached = self._load_cached_month(cache_path)
+        if cached is not None:
+            return cached
 
-                # 過濾掉非資料行 (通常前幾行或最後幾行是標題或空行)
-                raw_data = [line.strip() for line in lines if len(line.split('","')) >= 9]
-
-                if not raw_data:
-                    logging.warning(f"[{etf_code} {yyyymmdd}] 該月份無資料，直接返回空 DataFrame")
-                    return pd.DataFrame(columns=['Date','Close','Volume'])
+        try:
+            with self._rate:  # 限制同時對 TWSE 的在途請求數
+                # (連線, 讀取) timeout 分開設定，避免請求卡住
+                resp = self._session.get(url, timeout=(5, 20))
 
-                # 解析 CSV
-                df = pd.DataFrame([r.split('","') for r in raw_data])
-                df.columns = df.iloc[0].str.replace('"', '')
-                df = df.iloc[1:].copy()  # 去除表頭那一列
+            if resp.status_code != 200:
+                raise DataFetchError(f"HTTP 狀態碼非 200: {resp.status_code}")
 
-                # 取需要的欄位: 日期(0), 收盤價(6), 成交股數(1)
-                df['日期'] = df['日期'].str.replace('"','')
-                df['日期'] = df['日期'].apply(self._transform_date)
-                df['收盤價'] = df['收盤價'].str.replace(',','').astype(float)
-                df['成交股數'] = df['成交股數'].str.replace(',','').astype(float)
+            # 直接在 big5 bytes 上找表頭列位置 (TWSE CSV 首列為標題、尾端為說明文字)，
+            # 不先把整份內容解碼成 str、也不 split 出整份行列表
+            content = resp.content
+            header_pos = content.find('日期'.encode('big5'))
+            if header_pos == -1:
+                logging.warning(f"[{etf_code} {yyyymmdd}] 該月份無資料，直接返回空 DataFrame")
+                return pd.DataFrame(columns=['Date','Close','Volume'])
+            header_idx = content.count(b'\n', 0, header_pos)
 
-                output = df[['日期','收盤價','成交股數']].copy()
-                output.columns = ['Date','Close','Volume']
+            # 原始 bytes 交給 pandas 的 C parser 解析 (解碼在 parser 內完成)；
+            # thousands=',' 直接在解析時去除千分位逗號，dtype 宣告讓數值轉換一次完成
+            df = pd.read_csv(io.BytesIO(content), encoding='big5',
+                             skiprows=header_idx,
+                             thousands=',', na_values=['--', 'X'],
+                             usecols=['日期','成交股數','收盤價'],
+                             dtype={'收盤價': 'float64', '成交股數': 'float64'})
 
-                return output  # 成功抓取資料時直接回傳
+            # 去除尾端說明列：只保留「民國年/月/日」格式的資料列
+            df = df[df['日期'].astype(str).str.match(r'\d+/\d+/\d+')]
+            if df.empty:
+                logging.warning(f"[{etf_code} {yyyymmdd}] 該月份無資料，直接返回空 DataFrame")
+                return pd.DataFrame(columns=['Date','Close','Volume'])
 
-            except (requests.RequestException, DataFetchError) as e:
-                logging.warning(f"[{etf_code} {yyyymmdd}] 抓取失敗 (第 {attempt} 次): {e}")
+            # 民國年日期整欄向量化轉西元 (e.g. '112/01/05' -> 2023-01-05)：
+            # 一次 split、整數運算，再單次 to_datetime，避免逐列建 Timestamp；
+            # 先去除殘留的引號/空白，異常值以 coerce 轉 NaT 後丟棄
+            parts = (df['日期'].str.strip().str.strip('"')
+                     .str.split('/', expand=True)
+                     .apply(pd.to_numeric, errors='coerce'))
+            ymd = (parts[0] + 1911) * 10000 + parts[1] * 100 + parts[2]
+            df['日期'] = pd.to_datetime(ymd, format='%Y%m%d', errors='coerce')
+            df = df.dropna(subset=['日期'])
 
-            except Exception as e:
-                logging.error(f"[{etf_code} {yyyymmdd}] 未知錯誤: {e}")
+            output = df[['日期','收盤價','成交股數']].copy()
+            output.columns = ['Date','Close','Volume']
 
-            if attempt < max_retries:
-                logging.info(f"[{etf_code} {yyyymmdd}] 等待 {retry_delay} 秒後重試 ({attempt}/{max_retries}) ...")
-                time.sleep(retry_delay)
+            self._store_cached_month(cache_path, output)
+            return output  # 成功抓取資料時直接回傳
 
-        logging.error(f"[{etf_code} {yyyymmdd}] 多次重試失敗，返回空 DataFrame")
-        return pd.DataFrame(columns=['Date','Close','Volume'])  # 多次重試失敗則回傳空 DataFrame
+        except (requests.RequestException, DataFetchError) as e:
+            # 暫時性網路錯誤已由 urllib3 Retry 重試過；走到這裡代表整月失敗
+            logging.warning(f"[{etf_code} {yyyymmdd}] 抓取失敗: {e}")
 
-    def _transform_date(self, tw_date_str):
-        """
-        把 TWSE 的日期(民國年) 轉成西元datetime
-        e.g. '112/01/05' -> 2023-01-05
-        """
-        parts = tw_date_str.split('/')
-        year = int(parts[0]) + 1911
-        month = int(parts[1])
-        day = int(parts[2])
-        return pd.Timestamp(year, month, day)
+        return pd.DataFrame(columns=['Date','Close','Volume'])  # 失敗則回傳空 DataFrame
 
     def _fetch_from_yahoo(self, etf_code, start_date):
         """
@@ -1,13 +1,35 @@
 # modules/data_processor.py
 import pandas as pd
+import numpy as np
 from .storage import CSVStorage
 
+try:
+    import polars as pl
+    _HAS_POLARS = True
+except ImportError:
+    _HAS_POLARS = False
+
+# 各期間對應的天數，pandas 與 polars 路徑共用
+PERIOD_DAYS = {
+    '2w': 14,
+    '1m': 30,
+    '3m': 90,
+    '6m': 180,
+    '1y': 365,
+    '2y': 365*2,
+    '3y': 365*3
+}
+
 class ETFComparator:
-    def __init__(self, storage: CSVStorage):
+    def __init__(self, storage: CSVStorage, fast_df=None):
         """
         :param storage: CSVStorage的實例，用於讀取ETF資料
+        :param fast_df: 設為 'polars' 時改用 polars 後端讀取/過濾 (需安裝 polars
+                        且 storage 使用 Parquet 格式)，結果仍轉回 pandas
         """
         self.storage = storage
+        self.use_polars = (fast_df == 'polars' and _HAS_POLARS
+                           and getattr(storage, 'use_parquet', False))
 
     def compare_performance(self, etf_codes, period='1m'):
         """
@@ -15,6 +37,9 @@ class ETFComparator:
         :param etf_codes: ETF代碼列表 (ex: ['0050','0056','006208'])
         :param period: '2w'、'1m'、'3m'、'1y'、'3y'等
         """
+        if self.use_polars:
+            return self._compare_performance_polars(etf_codes, period)
+
         combined_list = []
         for code in etf_codes:
             df = self.storage.load_data(code)
@@ -23,6 +48,10 @@ class ETFComparator:
             filtered = self._filter_period(df, period)
             # 在合併前先加一欄 ETF_Code 以便後續繪圖或分析
             filtered['ETF_Code'] = code
+            # 只在比較用的暫時框架降型別：Close 落在 float32 的 ~7 位有效精度內，
+            # 砍半記憶體可提升 concat/groupby 的快取效率；Volume 是股數
+            # (可能超過 2^24)，保持原型別以免捨入
+            filtered['Close'] = filtered['Close'].astype('float32')
             combined_list.append(filtered)
 
         if combined_list:
@@ -30,28 +59,48 @@ class ETFComparator:
         else:
             return pd.DataFrame(columns=['Date','Close','Volume','ETF_Code'])
 
+    def _compare_performance_polars(self, etf_codes, period):
+        """
+        polars 後端：多執行緒讀取 Parquet 並在 Rust 引擎內串接/過濾，
+        最後轉回 pandas 讓下游繪圖/顯示不受影響
+        """
+        delta_days = PERIOD_DAYS.get(period, 30)
+        frames = []
+        for code in etf_codes:
+            path = self.storage.data_dir / f"{code}.parquet"
+            if not path.exists():
+                continue
+            frames.append(
+                pl.read_parquet(path).with_columns(pl.lit(code).alias('ETF_Code'))
+            )
+
+        if not frames:
+            return pd.DataFrame(columns=['Date','Close','Volume','ETF_Code'])
+
+        big = pl.concat(frames)
+        # 與 pandas 路徑相同語意：以「各ETF自己的最後日期」回推期間
+        big = big.filter(
+            pl.col('Date') >= pl.col('Date').max().over('ETF_Code')
+                              - pl.duration(days=delta_days)
+        )
+        return big.to_pandas()
+
     def _filter_period(self, df, period):
         """
         依 period 來過濾最近 n 天 / 月 / 年
-        這裡提供一種簡易示範：先把 df 排序，再利用日期篩選
+        storage 回傳的資料已依 Date 排序，直接用二分搜尋取出尾端切片，
+        免去重新排序與整欄布林遮罩
         """
-        df = df.sort_values('Date')
         if df.empty:
             return df
+        if not df['Date'].is_monotonic_increasing:
+            df = df.sort_values('Date')
+
+        end_date = df['Date'].iloc[-1]
 
-        end_date = df['Date'].max()
-        
-        # 可自訂更多區間對應
-        days_map = {
-            '2w': 14,
-            '1m': 30,
-            '3m': 90,
-            '6m': 180,
-            '1y': 365,
-            '2y': 365*2,
-            '3y': 365*3
-        }
-        delta_days = days_map.get(period, 30)  # 若period無法對應，就預設30天
+        delta_days = PERIOD_DAYS.get(period, 30)  # 若period無法對應，就預設30天
         start_date = end_date - pd.Timedelta(days=delta_days)
 
-        return df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
+        dates = df['Date'].to_numpy()
+        lo = np.searchsorted(dates, start_date.to_datetime64())
+        return df.iloc[lo:]
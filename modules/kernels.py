@@ -0,0 +1,63 @@
+# modules/kernels.py
+# 數值熱點的 JIT kernel；環境沒有 numba 時退回等價的 NumPy 實作
+import numpy as np
+
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+
+def _perf_kernel_numpy(start, end, days):
+    """純 NumPy 後援實作，介面與 JIT 版相同"""
+    cum = (end - start) / start
+    safe_days = np.where(days > 0, days, 1.0)
+    ann = np.where(days > 0, (1.0 + cum) ** (365.0 / safe_days) - 1.0, 0.0)
+    return cum, ann
+
+
+if _HAS_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def perf_kernel(start, end, days):
+        """
+        批次計算各ETF的累積漲幅與年化報酬率
+        :param start: 區間第一筆收盤價 (float64 array)
+        :param end: 區間最後一筆收盤價 (float64 array)
+        :param days: 區間天數 (float64 array)
+        :return: (cum, ann) 兩個 float64 array
+        """
+        n = start.size
+        cum = np.empty(n)
+        ann = np.empty(n)
+        for i in range(n):
+            c = (end[i] - start[i]) / start[i]
+            cum[i] = c
+            ann[i] = (1.0 + c) ** (365.0 / days[i]) - 1.0 if days[i] > 0 else 0.0
+        return cum, ann
+    @njit(cache=True, fastmath=True)
+    def repair_close(close, lower, upper):
+        """
+        單趟修復 Close 極端值：一邊維護視窗5的滾動平均 (min_periods=1 語意)，
+        一邊把 IQR 出界值換成該位置的滾動平均，全程無中間暫存陣列
+        :param close: 收盤價 (float64 array)
+        :param lower: IQR 下界
+        :param upper: IQR 上界
+        :return: 修復後的新陣列
+        """
+        n = close.shape[0]
+        out = close.copy()
+        s = 0.0
+        cnt = 0
+        for i in range(n):
+            s += close[i]
+            cnt += 1
+            if i >= 5:
+                s -= close[i - 5]
+                cnt -= 1
+            if out[i] > upper or out[i] < lower:
+                out[i] = s / cnt
+        return out
+else:
+    perf_kernel = _perf_kernel_numpy
+    repair_close = None  # 無 numba 時由呼叫端走 pandas rolling 後援路徑
@@ -4,15 +4,32 @@ import pandas as pd
 
 class ETFVisualizer:
     @staticmethod
-    def plot_comparison(combined_df: pd.DataFrame):
+    def plot_comparison(combined_df: pd.DataFrame, max_points: int = 2000):
         """
         將多支ETF的時間序列資料繪製成折線圖。
         要求: combined_df 需包含 'Date', 'Close', 'ETF_Code' 欄位。
+        :param max_points: 圖上資料點總數上限；超過時逐檔等距降採樣，
+                           減少 Plotly 傳給瀏覽器的 payload 與繪製時間
         """
         if combined_df.empty:
             print("沒有可繪圖的資料")
             return
-        
+
+        if len(combined_df) > max_points:
+            per_etf = max(1, max_points // combined_df['ETF_Code'].nunique())
+            combined_df = combined_df.sort_values(['ETF_Code', 'Date'])
+            # 不用 groupby.apply (pandas 3.0 會把分組欄從子框架剔除)，
+            # 改收集各ETF等距取樣的索引後一次 .loc；並保留各組最後一列，
+            # 避免最新收盤價被取樣間隔跳過
+            keep = []
+            for _, g in combined_df.groupby('ETF_Code', sort=False):
+                stride = max(1, len(g) // per_etf)
+                idx = list(g.index[::stride])
+                if idx[-1] != g.index[-1]:
+                    idx.append(g.index[-1])
+                keep.extend(idx)
+            combined_df = combined_df.loc[keep]
+
         fig = px.line(
             combined_df,
             x='Date',
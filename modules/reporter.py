@@ -1,4 +1,5 @@
 # modules/reporter.py
+import concurrent.futures
 import pandas as pd
 from .storage import CSVStorage
 
@@ -6,7 +7,7 @@ class ReportGenerator:
     def __init__(self, storage: CSVStorage):
         self.storage = storage
 
-    def generate_etf_report(self, etf_code):
+    def generate_etf_report(self, etf_code, df=None):
         """
         生成單一ETF報告，包含:
         - 數據期間
@@ -14,8 +15,10 @@ class ReportGenerator:
         - 缺失天數
         - 極端值數量
         - 零成交量天數
+        :param df: 已載入的DataFrame；未提供時自行從 storage 載入
         """
-        df = self.storage.load_data(etf_code)
+        if df is None:
+            df = self.storage.load_data(etf_code)
         if df.empty:
             return {
                 "ETF代碼": etf_code,
@@ -31,19 +34,21 @@ class ReportGenerator:
             "ETF代碼": etf_code,
             "數據期間": f"{df['Date'].min().strftime('%Y-%m-%d')} ~ {df['Date'].max().strftime('%Y-%m-%d')}",
             "總數據量": len(df),
-            "缺失天數": len(checks['date_gaps']),
-            "極端值數量": len(checks['outliers']),
-            "零成交量天數": len(checks['zero_volume'])
+            "缺失天數": checks['date_gap_count'],
+            "極端值數量": checks['outlier_count'],
+            "零成交量天數": checks['zero_volume_count']
         }
         return report
 
     def generate_comparison_report(self, etf_codes):
         """
         生成多ETF的比較報告，將每檔ETF的報告彙整在同一個DataFrame中。
+        各檔資料以執行緒池並行載入 (I/O-bound，讀檔期間釋放GIL)。
         """
-        all_reports = []
-        for code in etf_codes:
-            single_report = self.generate_etf_report(code)
-            all_reports.append(single_report)
+        max_workers = min(8, len(etf_codes)) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            dfs = list(executor.map(self.storage.load_data, etf_codes))
 
+        all_reports = [self.generate_etf_report(code, df=df)
+                       for code, df in zip(etf_codes, dfs)]
         return pd.DataFrame(all_reports)
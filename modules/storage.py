@@ -1,29 +1,45 @@
 # modules/storage.py
+import os
+import shutil
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import logging
 from datetime import datetime
 from typing import Dict, Union
-# from functools import lru_cache  # 若想對 load_data 做快取可開啟
+from .kernels import repair_close
 
 logger = logging.getLogger(__name__)
 
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
 class CSVStorage:
     """ETF數據存儲管理器，包含數據驗證、修復和版本控制功能"""
-    
+
     REQUIRED_COLUMNS = ['Date', 'Close', 'Volume']
     NUMERIC_COLS = ['Close', 'Volume']
-    
-    def __init__(self, data_dir: str = 'data', max_backups: int = 30):
+
+    def __init__(self, data_dir: str = 'data', max_backups: int = 30, use_parquet: bool = False):
         """
         初始化存儲管理器
         :param data_dir: 數據存儲目錄
         :param max_backups: 最大保留備份版本數
+        :param use_parquet: 是否以 Parquet (pyarrow) 格式存檔，讀寫速度遠快於 CSV
         """
         self.data_dir = Path(data_dir)
         self.backup_dir = self.data_dir / 'backups'
         self.max_backups = max_backups
+        # 若環境沒有 pyarrow 則自動退回 CSV
+        self.use_parquet = use_parquet and _HAS_PYARROW
+        if use_parquet and not _HAS_PYARROW:
+            logger.warning("未安裝 pyarrow，fast_io 設定無效，改用 CSV 格式")
+        # load_data 的行程內快取：path -> (mtime, DataFrame)；
+        # 以 mtime 失效，檔案被改寫即自動重讀，不靠TTL
+        self._cache: Dict[Path, tuple] = {}
         self._setup_directories()
         
     def _setup_directories(self) -> None:
@@ -44,13 +60,16 @@ class CSVStorage:
 
             processed_data = self._preprocess_data(new_data)
             combined_data = self._merge_with_existing(etf_code, processed_data)
-            
-            if self._needs_repair(combined_data):
+
+            # 完整性檢查只做一次，結果傳給 _needs_repair 重用
+            checks = self.check_data_integrity(combined_data)
+            if self._needs_repair(combined_data, checks):
                 combined_data = self.auto_repair_data(combined_data)
             
-            self._clean_backups(etf_code)
-            self.save_versioned_data(etf_code, combined_data)
+            # 先寫主檔，版本快照才能直接 hardlink 主檔、不必重新序列化
             self._save_to_main_file(etf_code, combined_data)
+            self.save_versioned_data(etf_code, combined_data)
+            self._clean_backups(etf_code)
             
             return True
             
@@ -58,58 +77,174 @@ class CSVStorage:
             logger.exception(f"保存 {etf_code} 數據時發生錯誤: {str(e)}")
             return False
     
-    # @lru_cache(maxsize=10)  # 可選，如果確定檔案不會頻繁更新，可開啟此快取
     def load_data(self, etf_code: str) -> pd.DataFrame:
-        """載入ETF歷史數據，並作後續基本處理"""
-        file_path = self.data_dir / f"{etf_code}.csv"
-        
-        if not file_path.exists():
-            logger.warning(f"{etf_code} 數據檔案不存在，回傳空DataFrame")
-            return pd.DataFrame(columns=self.REQUIRED_COLUMNS)
-        
+        """載入ETF歷史數據，並作後續基本處理 (同檔未變動時重用快取結果)"""
+        parquet_path = self.data_dir / f"{etf_code}.parquet"
+        csv_path = self.data_dir / f"{etf_code}.csv"
+
         try:
-            df = pd.read_csv(file_path, parse_dates=['Date'])
+            if self.use_parquet and parquet_path.exists():
+                file_path = parquet_path
+            elif csv_path.exists():
+                file_path = csv_path
+            else:
+                logger.warning(f"{etf_code} 數據檔案不存在，回傳空DataFrame")
+                return pd.DataFrame(columns=self.REQUIRED_COLUMNS)
+
+            # mtime 相同代表檔案未被改寫，直接回傳前次解析結果
+            mtime = file_path.stat().st_mtime
+            hit = self._cache.get(file_path)
+            if hit is not None and hit[0] == mtime:
+                return hit[1]
+
+            if file_path is parquet_path:
+                # Parquet 保留 dtype，Date 欄不需重新解析
+                df = pd.read_parquet(file_path, engine='pyarrow',
+                                     columns=self.REQUIRED_COLUMNS)
+            else:
+                # 舊格式 (或未開啟 fast_io) 的 CSV 後援路徑
+                df = pd.read_csv(file_path, parse_dates=['Date'])
+
             df = self._postprocess_data(df)
+            self._cache[file_path] = (mtime, df)
             return df
         except Exception as e:
             logger.error(f"載入 {etf_code} 數據失敗: {str(e)}")
             return pd.DataFrame(columns=self.REQUIRED_COLUMNS)
     
-    def check_data_integrity(self, df: pd.DataFrame) -> Dict[str, Union[pd.DataFrame, int]]:
-        """執行深度數據完整性檢查，回傳各種可疑數據"""
+    def migrate_csv_to_parquet(self) -> int:
+        """
+        一次性把資料夾內既有的 CSV 主檔轉成 Parquet (需啟用 use_parquet)
+        :return: 成功轉換的檔案數
+        """
+        if not self.use_parquet:
+            logger.warning("未啟用 Parquet 格式，略過轉檔")
+            return 0
+
+        migrated = 0
+        for csv_path in self.data_dir.glob('*.csv'):
+            parquet_path = csv_path.with_suffix('.parquet')
+            if parquet_path.exists():
+                continue
+            try:
+                df = pd.read_csv(csv_path, parse_dates=['Date'])
+                df.to_parquet(parquet_path, engine='pyarrow', compression='zstd', index=False)
+                migrated += 1
+                logger.info(f"已將 {csv_path.name} 轉為 {parquet_path.name}")
+            except Exception as e:
+                logger.error(f"轉換 {csv_path.name} 失敗: {str(e)}")
+        return migrated
+
+    def last_date(self, etf_code: str):
+        """
+        取得最後資料日期，但不載入整份資料：
+        Parquet 讀最後一個 row group 的欄位統計值、CSV 只讀檔案尾端
+        :return: 'YYYY-MM-DD' 字串；無資料時回傳 None
+        """
+        parquet_path = self.data_dir / f"{etf_code}.parquet"
+        csv_path = self.data_dir / f"{etf_code}.csv"
+
+        try:
+            if self.use_parquet and parquet_path.exists():
+                import pyarrow.parquet as pq
+                meta = pq.ParquetFile(parquet_path).metadata
+                if meta.num_rows == 0:
+                    return None
+                date_idx = meta.schema.to_arrow_schema().get_field_index('Date')
+                stats = meta.row_group(meta.num_row_groups - 1).column(date_idx).statistics
+                if stats is not None and stats.has_min_max:
+                    return pd.Timestamp(stats.max).strftime('%Y-%m-%d')
+            elif csv_path.exists():
+                # 只讀最後 512 bytes，解析最後一列的日期欄
+                with open(csv_path, 'rb') as f:
+                    f.seek(0, os.SEEK_END)
+                    f.seek(max(0, f.tell() - 512))
+                    tail = f.read().decode('utf-8', errors='replace')
+                lines = [ln for ln in tail.splitlines() if ln.strip()]
+                # strip('"')：容忍有引號的欄位，避免 writer 端格式漂移時整個解析失效
+                candidate = lines[-1].split(',')[0].strip('"') if lines else ''
+                ts = pd.to_datetime(candidate, errors='coerce')
+                # 表頭列 (只剩 'Date') 會轉成 NaT => 視為無資料
+                return None if pd.isna(ts) else ts.strftime('%Y-%m-%d')
+            else:
+                return None
+        except Exception as e:
+            logger.warning(f"快速讀取 {etf_code} 最後日期失敗，改用完整載入: {str(e)}")
+
+        df = self.load_data(etf_code)
+        return None if df.empty else df['Date'].max().strftime('%Y-%m-%d')
+
+    def check_data_integrity(self, df: pd.DataFrame) -> Dict[str, Union[int, np.ndarray, dict]]:
+        """
+        執行深度數據完整性檢查，只回傳計數與位置索引
+        (呼叫端多半只需要「有幾筆」；需要實際資料列時用 get_integrity_details)
+        """
         results = {}
         if df.empty:
             # 如果是空的，就直接回傳空結果
-            results['date_gaps'] = pd.Series([], dtype='int')
-            results['outliers'] = pd.DataFrame(columns=df.columns)
-            results['zero_volume'] = pd.DataFrame(columns=df.columns)
+            results['date_gap_count'] = 0
+            results['date_gap_positions'] = np.array([], dtype=np.int64)
+            results['outlier_count'] = 0
+            results['zero_volume_count'] = 0
             results['missing_values'] = {col: 0 for col in self.NUMERIC_COLS}
             return results
-        
-        # 排序日期，計算日期差
+
+        # 一次抽出 NumPy 陣列供所有檢查共用，避免每項檢查各自配置布林 Series
         df = df.sort_values('Date')
-        date_diff = df['Date'].diff().dt.days.dropna()
-        gaps = date_diff[date_diff > 1]
-        results['date_gaps'] = gaps
-        
+        dates = df['Date'].to_numpy()
+        close = df['Close'].to_numpy(dtype='float64')
+        volume = df['Volume'].to_numpy(dtype='float64')
+
+        # 日期差 (天)
+        day_diff = np.diff(dates).astype('timedelta64[D]').astype(np.int64)
+        gap_mask = day_diff > 1
+        results['date_gap_positions'] = np.nonzero(gap_mask)[0] + 1
+        results['date_gap_count'] = int(results['date_gap_positions'].size)
+
         # 數值異常值檢查
-        close_stats = df['Close'].describe()
-        iqr = close_stats['75%'] - close_stats['25%']
-        outliers = df[
-            (df['Close'] < (close_stats['25%'] - 3 * iqr)) | 
-            (df['Close'] > (close_stats['75%'] + 3 * iqr))
-        ]
-        results['outliers'] = outliers
-        
+        lower_bound, upper_bound = self._close_bounds(df)
+        out_mask = (close < lower_bound) | (close > upper_bound)
+        results['outlier_count'] = int(np.count_nonzero(out_mask))
+
         # 零成交量
-        zero_volume = df[df['Volume'] == 0]
-        results['zero_volume'] = zero_volume
-        
+        results['zero_volume_count'] = int(np.count_nonzero(volume == 0))
+
         # 缺失值
-        missing_values = df[self.NUMERIC_COLS].isnull().sum().to_dict()
-        results['missing_values'] = missing_values
-        
+        results['missing_values'] = {
+            col: int(np.isnan(arr).sum())
+            for col, arr in zip(self.NUMERIC_COLS, (close, volume))
+        }
+
         return results
+
+    def get_integrity_details(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        回傳完整性檢查實際命中的資料列；只在需要檢視明細時呼叫，
+        一般流程 (報表、修復判斷) 用 check_data_integrity 的計數即可
+        """
+        if df.empty:
+            return {
+                'date_gaps': df.copy(),
+                'outliers': df.copy(),
+                'zero_volume': df.copy(),
+            }
+
+        df = df.sort_values('Date')
+        dates = df['Date'].to_numpy()
+        close = df['Close'].to_numpy(dtype='float64')
+        volume = df['Volume'].to_numpy(dtype='float64')
+
+        day_diff = np.diff(dates).astype('timedelta64[D]').astype(np.int64)
+        gap_pos = np.nonzero(day_diff > 1)[0] + 1
+
+        lower_bound, upper_bound = self._close_bounds(df)
+        out_mask = (close < lower_bound) | (close > upper_bound)
+
+        return {
+            'date_gaps': df.iloc[gap_pos],
+            'outliers': df.iloc[np.nonzero(out_mask)[0]],
+            'zero_volume': df.iloc[np.nonzero(volume == 0)[0]],
+        }
     
     def auto_repair_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """簡單的自動修復邏輯：插值填補、移動平均修復極端值、以及零成交量處理"""
@@ -119,40 +254,62 @@ class CSVStorage:
         # 確保日期已排序
         df = df.sort_values('Date')
 
-        # 先把 'Date' 設為 DatetimeIndex
-        df = df.set_index('Date')
-
-        # 填充缺失值 (time-based)
-        df[self.NUMERIC_COLS] = df[self.NUMERIC_COLS].interpolate(method='time')
+        # 填充缺失值 (time-based)：直接以 int64 日期值做 np.interp，
+        # 免去 set_index('Date') / reset_index() 的索引重建
+        t = df['Date'].to_numpy().astype('int64').astype('float64')
+        for col in self.NUMERIC_COLS:
+            vals = df[col].to_numpy(dtype='float64', copy=True)
+            missing = np.isnan(vals)
+            if missing.any() and not missing.all():
+                vals[missing] = np.interp(t[missing], t[~missing], vals[~missing])
+                df[col] = vals
 
-        # 移動平均修復極端值
-        close_stats = df['Close'].describe()
-        iqr = close_stats['75%'] - close_stats['25%']
-        upper_bound = close_stats['75%'] + 3 * iqr
-        lower_bound = close_stats['25%'] - 3 * iqr
-
-        df['Close'] = df['Close'].mask(
-            df['Close'] > upper_bound,
-            df['Close'].rolling(5, min_periods=1).mean()
-        )
-        df['Close'] = df['Close'].mask(
-            df['Close'] < lower_bound,
-            df['Close'].rolling(5, min_periods=1).mean()
-        )
+        # 移動平均修復極端值：rolling mean 只算一次，且僅替換出界位置
+        close = df['Close'].to_numpy(dtype='float64', copy=True)
+        lower_bound, upper_bound = self._close_bounds(df)
+        out_of_bounds = (close > upper_bound) | (close < lower_bound)
+        if out_of_bounds.any():
+            if repair_close is not None:
+                # JIT kernel 單趟完成滾動平均與出界值替換
+                df['Close'] = repair_close(close, lower_bound, upper_bound)
+            else:
+                roll = pd.Series(close).rolling(5, min_periods=1).mean().to_numpy()
+                close[out_of_bounds] = roll[out_of_bounds]
+                df['Close'] = close
 
         # 交易量若為 0 則用前值填補
         df['Volume'] = df['Volume'].replace(0, pd.NA).ffill()
 
-        # 復原 index 為原本的欄位
-        df = df.reset_index()
-
         return df
     
     def save_versioned_data(self, etf_code: str, data: pd.DataFrame) -> None:
-        """建立備份版本"""
+        """
+        建立備份版本：主檔已寫入時直接 hardlink (零拷貝、一個 inode 操作)；
+        主檔每次更新都以新 inode 取代 (見 _save_to_main_file)，舊快照不受影響。
+        hardlink 不可用 (跨檔案系統等) 時退回完整複製/序列化。
+        """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = self.backup_dir / f"{etf_code}_{timestamp}.csv"
-        data.to_csv(backup_path, index=False)
+        suffix = 'parquet' if self.use_parquet else 'csv'
+        backup_path = self.backup_dir / f"{etf_code}_{timestamp}.{suffix}"
+        main_path = self.data_dir / f"{etf_code}.{suffix}"
+
+        if main_path.exists():
+            try:
+                os.link(main_path, backup_path)
+                logger.info(f"[{etf_code}] 已建立版本快照: {backup_path.name}")
+                return
+            except OSError:
+                try:
+                    shutil.copy2(main_path, backup_path)
+                    logger.info(f"[{etf_code}] 已建立版本快照 (複製): {backup_path.name}")
+                    return
+                except OSError as e:
+                    logger.warning(f"[{etf_code}] 快照複製失敗，改為重新序列化: {e}")
+
+        if self.use_parquet:
+            data.to_parquet(backup_path, engine='pyarrow', compression='zstd', index=False)
+        else:
+            self._write_csv(data, backup_path)
         logger.info(f"[{etf_code}] 已建立版本快照: {backup_path.name}")
     
     def _validate_basic(self, data: pd.DataFrame) -> bool:
@@ -184,37 +341,87 @@ class CSVStorage:
         return df
     
     def _postprocess_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """讀檔後的後處理"""
-        df = df.sort_values('Date')
-        df[self.NUMERIC_COLS] = df[self.NUMERIC_COLS].fillna(method='ffill').fillna(method='bfill')
+        """
+        讀檔後的後處理。寫入端已保證排序與無缺值 (save_data 會先驗證/修復)，
+        讀取端只做廉價的不變量檢查，僅在遇到舊格式檔案時才重新整理
+        """
+        if not df.empty and not df['Date'].is_monotonic_increasing:
+            logger.warning("讀入資料未依Date排序 (寫入端不變量被破壞?)，重新排序")
+            df = df.sort_values('Date')
+            df[self.NUMERIC_COLS] = df[self.NUMERIC_COLS].ffill().bfill()
         return df
     
+    def _write_csv(self, data: pd.DataFrame, path: Path) -> None:
+        """
+        寫出CSV：有 pyarrow 時改走其 C++ writer (批次格式化)，
+        避開 DataFrame.to_csv 逐格的 Python 字串轉換；否則退回 to_csv
+        """
+        if _HAS_PYARROW:
+            import pyarrow as pa
+            import pyarrow.csv as pacsv
+            out = data.copy()
+            out['Date'] = out['Date'].dt.strftime('%Y-%m-%d')
+            # quoting_style='none'：日期與數值都不需要引號，輸出列才真正
+            # 與 to_csv 後援相同；'needed' 仍會把字串欄整欄加引號
+            pacsv.write_csv(pa.Table.from_pandas(out, preserve_index=False), path,
+                            write_options=pacsv.WriteOptions(quoting_style='none'))
+        else:
+            data.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+    def _meta_path(self, etf_code: str) -> Path:
+        return self.data_dir / f"{etf_code}.meta"
+
+    def _read_meta(self, etf_code: str):
+        """讀取上次寫檔時記錄的最大日期；meta 不存在或格式錯誤時回傳 None"""
+        try:
+            text = self._meta_path(etf_code).read_text().strip()
+            return pd.Timestamp(text) if text else None
+        except (FileNotFoundError, ValueError):
+            return None
+
     def _merge_with_existing(self, etf_code: str, new_data: pd.DataFrame) -> pd.DataFrame:
         """將新數據合併至舊數據"""
         existing = self.load_data(etf_code)
         if existing.empty:
             return new_data
-        
+
+        # 快速附加路徑：每日增量更新的新資料全部晚於上次寫檔的最大日期，
+        # 直接串接即可，省去對整段歷史的 drop_duplicates / sort_values
+        last_date = self._read_meta(etf_code)
+        if last_date is not None and (new_data['Date'] > last_date).all():
+            return pd.concat([existing, new_data], ignore_index=True)
+
         combined = pd.concat([existing, new_data], ignore_index=True)
         combined = combined.drop_duplicates(subset='Date')
         combined = combined.sort_values('Date')
         return combined
     
-    def _needs_repair(self, data: pd.DataFrame) -> bool:
-        """判斷是否需要進行自動修復"""
-        checks = self.check_data_integrity(data)
+    def _close_bounds(self, df: pd.DataFrame):
+        """
+        以單次 quantile 計算 Close 的 IQR 異常值上下界，
+        取代原本為了 25%/75% 而整組計算的 describe()
+        """
+        q25, q75 = np.nanquantile(df['Close'].to_numpy(dtype='float64'), [0.25, 0.75])
+        iqr = q75 - q25
+        return q25 - 3 * iqr, q75 + 3 * iqr
+
+    def _needs_repair(self, data: pd.DataFrame, checks=None) -> bool:
+        """判斷是否需要進行自動修復；可傳入已算好的完整性檢查結果避免重算"""
+        if checks is None:
+            checks = self.check_data_integrity(data)
         if data.empty:
             return False
         
         return any([
-            not checks['date_gaps'].empty,
-            not checks['outliers'].empty,
+            checks['date_gap_count'] > 0,
+            checks['outlier_count'] > 0,
             any(val > 0 for val in checks['missing_values'].values())
         ])
     
     def _clean_backups(self, etf_code: str) -> None:
         """刪除過舊的備份檔"""
-        backups = sorted(self.backup_dir.glob(f"{etf_code}_*.csv"))
+        backups = sorted(self.backup_dir.glob(f"{etf_code}_*.csv")) + \
+                  sorted(self.backup_dir.glob(f"{etf_code}_*.parquet"))
         if len(backups) > self.max_backups:
             to_remove = backups[:-self.max_backups]
             for backup in to_remove:
@@ -222,7 +429,24 @@ class CSVStorage:
                 logger.debug(f"已移除過期備份: {backup.name}")
     
     def _save_to_main_file(self, etf_code: str, data: pd.DataFrame) -> None:
-        """最終儲存至主檔案"""
-        file_path = self.data_dir / f"{etf_code}.csv"
-        data.to_csv(file_path, index=False, date_format='%Y-%m-%d')
+        """
+        最終儲存至主檔案。先寫暫存檔再 os.replace：寫入具原子性，
+        且每次儲存產生新 inode，既有的 hardlink 快照不會被改寫
+        """
+        suffix = 'parquet' if self.use_parquet else 'csv'
+        file_path = self.data_dir / f"{etf_code}.{suffix}"
+        tmp_path = file_path.with_suffix(f".{suffix}.tmp")
+
+        if self.use_parquet:
+            data.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+        else:
+            self._write_csv(data, tmp_path)
+        os.replace(tmp_path, file_path)
+        # 同步更新行程內快取，讓同行程的下一次 load_data 不需重讀
+        self._cache[file_path] = (file_path.stat().st_mtime,
+                                  self._postprocess_data(data))
+
+        # 記錄本次寫入的最大日期，供 _merge_with_existing 的快速附加路徑使用
+        if not data.empty:
+            self._meta_path(etf_code).write_text(str(data['Date'].max().date()))
         logger.info(f"[{etf_code}] 成功寫入主檔案，共 {len(data)} 筆記錄")